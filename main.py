@@ -2,21 +2,30 @@
 # --------------------------------------------------------------
 # Re-implementation of the JICSE paper (June 2024 data dump)
 # --------------------------------------------------------------
-# 1. Load the official Stack Exchange XML dump
-# 2. Keep the top-100 tags
-# 3. Build per-user tag-reputation
-# 4. Classify users into I / T / Pi / Comb shapes
-# 5. Parse 1.2 M answers → length, code, image, reference flags
-# 6. Logistic-regression per shape
-# 7. Print the same Table 1 as in the paper
+# 1. Load the official Stack Exchange XML dump, keep the top-100 tags
+# 2. Answer features: length, code, image, reference flags
+# 3. One Users + one Posts pass → per-user tag-reputation and
+#    the features of 1.2 M answers
+# 4. Cache the parsed tables as Parquet
+# 5. Classify users into I / T / Pi / Comb shapes
+# 6. Link answers to shapes, prepare the regression inputs
+# 7. Logistic-regression per shape
+# 8. Print the same Table 1 as in the paper
 # --------------------------------------------------------------
 
-import xml.etree.ElementTree as ET
+from lxml import etree as ET
 import pandas as pd
 import numpy as np
+from numba import njit, prange
 from pathlib import Path
-from collections import Counter, defaultdict
+from array import array
+from collections import Counter
+from itertools import chain
 import re
+import sys
+import json
+from scipy.sparse import csr_matrix
+from joblib import Parallel, delayed
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import classification_report
 import warnings
@@ -29,245 +38,368 @@ DATA_DIR = Path("stackexchange")          # folder that contains the XML files
 USERS_XML = DATA_DIR / "Users.xml"
 POSTS_XML = DATA_DIR / "Posts.xml"
 TAGS_XML  = DATA_DIR / "Tags.xml"
+CACHE_DIR = DATA_DIR / "cache"            # Parquet copies of the parsed tables
+CACHE_VERSION = 1                         # bump when the tag-rep or answer-feature logic changes
 
 TOP_N_TAGS = 100
 MIN_REPUTATION = 100
 MIN_CODE_LINES = 5
 WORD_THRESHOLD_SHORT = 150
 WORD_THRESHOLD_LONG  = 400
+ANSWER_CHUNK = 100_000    # answer bodies held in memory before their features are extracted
+
+# Patterns used in the hot loops, compiled once
+_TAG_RE  = re.compile(r"<([^>]+)>")
+_WORD_RE = re.compile(r"\w+")
+# a <code> block with at least MIN_CODE_LINES lines as len(block.splitlines()) counts
+# them: MIN_CODE_LINES-1 line breaks still followed by text (a trailing break ends
+# the last line, it does not start a new one). Breaks are the ones str.splitlines
+# knows, with \r\n as a single break.
+_LINE_BREAK = r"(?:\r\n|\r(?!\n)|[\n\x0b\x0c\x1c-\x1e\x85\u2028\u2029])"
+_LINE_CHAR  = r"(?:(?!</code>)[^\r\n\x0b\x0c\x1c-\x1e\x85\u2028\u2029])"
+_LONG_CODE_RE = re.compile(
+    rf"<code>(?:{_LINE_CHAR}*{_LINE_BREAK}){{{MIN_CODE_LINES - 1}}}(?:(?!</code>).)+</code>",
+    re.DOTALL)
+_IMG_RE  = re.compile(r"<img\s")
+_EXT_HREF_RE = re.compile(r'<a href="(?!https://stackoverflow\.com|//stackoverflow\.com)[^"]+"')
+
+# ------------------------------------------------------------------
+# XML streaming helper
+# ------------------------------------------------------------------
+def iter_rows(path):
+    """Yield every <row> of a dump file without building the whole tree."""
+    context = ET.iterparse(str(path), events=("end",), tag="row",
+                           huge_tree=True, recover=True)
+    for _, elem in context:
+        yield elem
+        elem.clear()
+        # drop already-processed siblings still referenced by the root
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
 
 # ------------------------------------------------------------------
 # 1. Load the top-100 tags
 # ------------------------------------------------------------------
 def load_top_tags():
-    tree = ET.parse(TAGS_XML)
-    root = tree.getroot()
     tags = []
-    for t in root.findall("row"):
+    for t in iter_rows(TAGS_XML):
         name = t.get("TagName")
         count = int(t.get("Count", 0))
         tags.append((name, count))
     tags.sort(key=lambda x: -x[1])
-    return [t[0] for t in tags[:TOP_N_TAGS]]
+    # interned so every tag parsed from Posts.xml can share these objects
+    return frozenset(sys.intern(t[0]) for t in tags[:TOP_N_TAGS])
 
 TOP_TAGS = load_top_tags()
 print(f"Top {TOP_N_TAGS} tags loaded ({len(TOP_TAGS)} tags)")
 
 # ------------------------------------------------------------------
-# 2. Build per-user tag-reputation matrix
+# 2. Parse answers → features
 # ------------------------------------------------------------------
-def build_tag_reputation():
-    tree = ET.parse(USERS_XML)
-    root = tree.getroot()
-
-    user_rep = {}          # user_id → total reputation
-    user_tags = defaultdict(Counter)   # user_id → tag → reputation earned
-
-    # First pass: total reputation
-    for u in root.findall("row"):
-        uid = int(u.get("Id"))
-        rep = int(u.get("Reputation"))
-        if rep >= MIN_REPUTATION:
-            user_rep[uid] = rep
-
-    # Second pass: reputation per tag (via UpVotes/DownVotes on posts)
-    tree = ET.parse(POSTS_XML)
-    root = tree.getroot()
-    for p in root.findall("row"):
+def _body_features(bodies: pd.Series):
+    # object dtype keeps the .str scans on Python's re: Arrow-backed strings
+    # (pandas ≥3 + pyarrow) go through RE2, where \w is ASCII-only and
+    # non-ASCII answers would be miscounted
+    bodies = bodies.astype(object)
+    feats = pd.DataFrame(index=bodies.index)
+
+    # word count
+    feats["word_count"] = bodies.str.count(_WORD_RE)
+    # length dummies, Medium is the baseline
+    feats["is_long"] = (feats["word_count"] > WORD_THRESHOLD_LONG).astype(np.int8)
+    feats["is_summ"] = (feats["word_count"] < WORD_THRESHOLD_SHORT).astype(np.int8)
+
+    # code blocks (at least MIN_CODE_LINES lines)
+    feats["has_code"] = bodies.str.contains(_LONG_CODE_RE).astype(np.int8)
+
+    # images
+    feats["has_image"] = bodies.str.contains(_IMG_RE).astype(np.int8)
+
+    # external references (ignore SO internal links)
+    feats["has_ref"] = bodies.str.contains(_EXT_HREF_RE).astype(np.int8)
+
+    return feats
+
+def answer_features(bodies: pd.Series):
+    # duplicate / boilerplate bodies are scanned only once
+    codes, uniques = pd.factorize(bodies.fillna(""))
+    feats = _body_features(pd.Series(uniques, dtype=object))
+    return feats.iloc[codes].set_axis(bodies.index)
+
+def answer_chunk(rows):
+    # (answer_id, user_id, body, score, accepted) rows → ids + features, no bodies
+    aids, uids, bodies, upvotes, accepted = zip(*rows) if rows else ((),) * 5
+    answers = pd.DataFrame({
+        "answer_id": np.array(aids, dtype=np.int32),
+        "owner_id": np.array(uids, dtype=np.int32),
+        "upvotes": np.array(upvotes, dtype=np.int32),
+        "accepted": np.array(accepted, dtype=bool),
+    })
+    return answers.join(answer_features(pd.Series(bodies, dtype=object)))
+
+# ------------------------------------------------------------------
+# 3. Build per-user tag-reputation matrix + answer features (one Posts pass)
+# ------------------------------------------------------------------
+def load_rep_users():
+    # Users pass: ids of users with ≥ MIN_REPUTATION
+    ids, reps = array("i"), array("i")
+    for u in iter_rows(USERS_XML):
+        ids.append(int(u.get("Id")))
+        reps.append(int(u.get("Reputation")))
+    ids = np.frombuffer(ids, dtype=np.int32)
+    reps = np.frombuffer(reps, dtype=np.int32)
+
+    # a set is the fastest per-post membership test from Python
+    return frozenset(ids[reps >= MIN_REPUTATION].tolist())
+
+def parse_posts(rep_users):
+    user_tags = {}         # user_id → {tag → reputation earned}
+    answer_chunks = []     # per-answer ids + features, bodies already dropped
+    pending = []           # (answer_id, user_id, body, score, accepted) not yet extracted
+
+    # Reputation per tag (via UpVotes/DownVotes on posts).
+    # Answers are handled in the same sweep so Posts.xml is read only once.
+    # Features only depend on the body, so they are extracted every
+    # ANSWER_CHUNK answers and the bodies dropped; shapes are attached later.
+    for p in iter_rows(POSTS_XML):
         owner = p.get("OwnerUserId")
         if owner is None:
             continue
         uid = int(owner)
-        if uid not in user_rep:
+        if uid not in rep_users:
+            continue
+
+        ptype = int(p.get("PostTypeId", 0))
+        score = int(p.get("Score", 0))
+        if ptype == 2:        # 2 = Answer
+            aid = int(p.get("Id"))
+            pending.append((aid, uid, p.get("Body", ""), score,
+                            int(p.get("AcceptedAnswerId", 0)) == aid))
+            if len(pending) >= ANSWER_CHUNK:
+                answer_chunks.append(answer_chunk(pending))
+                pending = []
             continue
 
         tags = p.get("Tags")
         if not tags:
             continue
         # extract tags: <python><java> → ['python','java']
-        post_tags = re.findall(r"<([^>]+)>", tags)
-        post_tags = [t for t in post_tags if t in TOP_TAGS]
+        post_tags = [sys.intern(t) for t in _TAG_RE.findall(tags) if t in TOP_TAGS]
         if not post_tags:
             continue
 
-        score = int(p.get("Score", 0))
         # simple proxy: reputation = score * 10 (the official formula is more complex,
-        # but for ranking it is monotonic)
+        # but for ranking it is monotonic). Posts with score ≤ 0 still add their tags
+        # with 0 rep, which counts towards the number of tags in classify_shapes().
         rep_gain = max(score * 10, 0)
 
+        d = user_tags.get(uid)
+        if d is None:
+            d = {}
+            user_tags[uid] = d
         for t in post_tags:
-            user_tags[uid][t] += rep_gain
+            d[t] = d.get(t, 0) + rep_gain
 
-    return user_rep, user_tags
+    answer_chunks.append(answer_chunk(pending))
+    answers = pd.concat(answer_chunks, ignore_index=True)
 
-print("Building tag-reputation matrix …")
-user_rep, user_tags = build_tag_reputation()
-print(f"   → {len(user_rep):,} users with ≥{MIN_REPUTATION} rep")
+    return user_tags, answers
 
 # ------------------------------------------------------------------
-# 3. Classify users into expertise shapes
+# 4. Cache the parsed tables (skip the XML passes on re-runs)
 # ------------------------------------------------------------------
-def classify_shape(tag_counter: Counter):
-    if not tag_counter:
+def _cache_key():
+    # dump files (size + mtime) and every setting the parsed tables depend on
+    key = {p.name: [p.stat().st_size, p.stat().st_mtime_ns]
+           for p in (TAGS_XML, USERS_XML, POSTS_XML)}
+    key["config"] = [TOP_N_TAGS, MIN_REPUTATION, MIN_CODE_LINES,
+                     WORD_THRESHOLD_SHORT, WORD_THRESHOLD_LONG]
+    key["version"] = CACHE_VERSION
+    key["patterns"] = [r.pattern for r in
+                       (_TAG_RE, _WORD_RE, _LONG_CODE_RE, _IMG_RE, _EXT_HREF_RE)]
+    return key
+
+def load_cache(key):
+    meta_file = CACHE_DIR / "meta.json"
+    if not meta_file.exists():
+        return None
+    try:
+        return _read_cache(json.loads(meta_file.read_text()), key)
+    except (OSError, ValueError, KeyError, AttributeError) as e:   # missing / corrupt → re-parse
+        print(f"Ignoring unreadable cache in {CACHE_DIR}: {e}")
         return None
-    items = sorted(tag_counter.items(), key=lambda x: -x[1])
-    total = sum(tag_counter.values())
-    if total == 0:
+
+def _read_cache(meta, key):
+    if meta.get("key") != key:
         return None
 
-    percs = [v / total for _, v in items]
+    # long form (uid, tag, rep) → {uid: {tag: rep}}
+    long_tags = pd.read_parquet(CACHE_DIR / "user_tags.parquet")
+    tag_col = long_tags["tag"].astype("category")
+    names = [sys.intern(t) for t in tag_col.cat.categories]
+    user_tags = {}
+    for uid, code, rep in zip(long_tags["uid"].tolist(), tag_col.cat.codes.tolist(),
+                              long_tags["rep"].tolist()):
+        d = user_tags.get(uid)
+        if d is None:
+            d = {}
+            user_tags[uid] = d
+        d[names[code]] = rep
+
+    answers = pd.read_parquet(CACHE_DIR / "answers.parquet")
+    return meta["n_users"], user_tags, answers
+
+def save_cache(key, n_users, user_tags, answers):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+    counts = np.fromiter((len(d) for d in user_tags.values()),
+                         dtype=np.int64, count=len(user_tags))
+    long_tags = pd.DataFrame({
+        "uid": np.repeat(np.fromiter(user_tags, dtype=np.int32, count=len(user_tags)), counts),
+        "tag": pd.Categorical(list(chain.from_iterable(d.keys() for d in user_tags.values()))),
+        "rep": np.fromiter(chain.from_iterable(d.values() for d in user_tags.values()),
+                           dtype=np.int64, count=counts.sum()),
+    })
+    long_tags.to_parquet(CACHE_DIR / "user_tags.parquet", compression="zstd", index=False)
+    answers.to_parquet(CACHE_DIR / "answers.parquet", compression="zstd", index=False)
+
+    # written last, so an interrupted save is never picked up
+    (CACHE_DIR / "meta.json").write_text(json.dumps({"key": key, "n_users": n_users}))
+
+cache_key = _cache_key()
+cached = load_cache(cache_key)
+if cached is not None:
+    print(f"Loading parsed tables from {CACHE_DIR} …")
+    n_users, user_tags, answers = cached
+else:
+    print("Building tag-reputation matrix and answer features …")
+    rep_users = load_rep_users()
+    n_users = len(rep_users)
+    user_tags, answers = parse_posts(rep_users)
+    del rep_users
+
+    # only owners with tag reputation can end up with a shape
+    answers = answers[answers["owner_id"].isin(list(user_tags))].reset_index(drop=True)
+    save_cache(cache_key, n_users, user_tags, answers)
+del cached
+print(f"   → {n_users:,} users with ≥{MIN_REPUTATION} rep")
+
+# ------------------------------------------------------------------
+# 5. Classify users into expertise shapes
+# ------------------------------------------------------------------
+SHAPE_NAMES = ("I", "T", "Pi", "Comb")   # index = code returned by _classify
+
+@njit(cache=True)
+def _classify(percs, n_items):
+    # percs: tag shares sorted descending → shape code, -1 if none
 
     # I-shaped: ≥90 % in ONE tag
     if percs[0] >= 0.90:
-        return "I"
+        return 0
 
     # T-shaped: 50-70 % in ONE tag + ≥10 other tags
-    if 0.50 <= percs[0] <= 0.70 and len(items) >= 11:
-        return "T"
+    if 0.50 <= percs[0] <= 0.70 and n_items >= 11:
+        return 1
 
     # Pi-shaped: two tags 30-45 % each, together ≥70 %
-    if len(items) >= 2 and 0.30 <= percs[0] <= 0.45 and 0.30 <= percs[1] <= 0.45:
+    if n_items >= 2 and 0.30 <= percs[0] <= 0.45 and 0.30 <= percs[1] <= 0.45:
         if percs[0] + percs[1] >= 0.70:
-            return "Pi"
+            return 2
 
     # Comb-shaped: 3-5 tags each 15-25 %, none >30 %
-    top5 = percs[:5]
-    if 3 <= len([p for p in top5 if 0.15 <= p <= 0.25]) <= 5 and percs[0] <= 0.30:
-        return "Comb"
+    n_mid = 0
+    for i in range(min(n_items, 5)):
+        if 0.15 <= percs[i] <= 0.25:
+            n_mid += 1
+    if 3 <= n_mid <= 5 and percs[0] <= 0.30:
+        return 3
+
+    return -1
+
+@njit(cache=True, parallel=True)
+def _classify_batch(vals, offsets):
+    # user i owns vals[offsets[i]:offsets[i + 1]] → one shape code per user
+    codes = np.full(offsets.size - 1, -1, dtype=np.int8)
+    for i in prange(offsets.size - 1):
+        seg = vals[offsets[i]:offsets[i + 1]]
+        total = seg.sum()
+        if seg.size == 0 or total == 0:
+            continue
+        percs = np.sort(seg)[::-1] / total
+        codes[i] = _classify(percs, seg.size)
+    return codes
+
+def classify_shapes(user_tags: dict):
+    # flatten {uid: {tag: rep}} into one value array + per-user offsets
+    counts = np.fromiter((len(d) for d in user_tags.values()),
+                         dtype=np.int64, count=len(user_tags))
+    offsets = np.zeros(counts.size + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    vals = np.fromiter(chain.from_iterable(d.values() for d in user_tags.values()),
+                       dtype=np.float64, count=offsets[-1])
 
-    return None
+    codes = _classify_batch(vals, offsets)
+    return {uid: SHAPE_NAMES[c] for uid, c in zip(user_tags, codes.tolist()) if c >= 0}
 
-shape_counts = Counter()
-user_shape = {}
-for uid, cnt in user_tags.items():
-    sh = classify_shape(cnt)
-    if sh:
-        user_shape[uid] = sh
-        shape_counts[sh] += 1
+user_shape = classify_shapes(user_tags)
+shape_counts = Counter(user_shape.values())
 
 print("Shape distribution:")
 for sh, cnt in shape_counts.most_common():
     print(f"   {sh}-shaped: {cnt:,}")
 
 # ------------------------------------------------------------------
-# 4. Parse answers → features
+# 6. Prepare data for logistic regression
 # ------------------------------------------------------------------
-def answer_features(body: str):
-    if not body:
-        return {}
-    # word count
-    words = len(re.findall(r"\w+", body))
-    length = "Long" if words > WORD_THRESHOLD_LONG else ("Summarized" if words < WORD_THRESHOLD_SHORT else "Medium")
-
-    # code blocks (at least MIN_CODE_LINES lines)
-    code_blocks = re.findall(r"<code>(.*?)</code>", body, re.DOTALL)
-    has_code = any(len(cb.splitlines()) >= MIN_CODE_LINES for cb in code_blocks)
-
-    # images
-    has_image = bool(re.search(r"<img\s", body))
-
-    # external references (ignore SO internal links)
-    links = re.findall(r'<a href="([^"]+)"', body)
-    external = any(not link.startswith("https://stackoverflow.com") and
-                   not link.startswith("//stackoverflow.com") for link in links)
-    has_ref = external
-
-    return {
-        "length": length,
-        "has_code": has_code,
-        "has_image": has_image,
-        "has_ref": has_ref,
-        "word_count": words
-    }
-
-print("Parsing 1.2 M answers …")
-answer_df = []
-tree = ET.parse(POSTS_XML)
-root = tree.getroot()
-for p in root.findall("row"):
-    ptype = int(p.get("PostTypeId", 0))
-    if ptype != 2:            # 2 = Answer
-        continue
-    owner = p.get("OwnerUserId")
-    if owner is None:
-        continue
-    uid = int(owner)
-    if uid not in user_shape:
-        continue
-
-    aid = int(p.get("Id"))
-    body = p.get("Body", "")
-    feats = answer_features(body)
-    feats.update({
-        "answer_id": aid,
-        "owner_id": uid,
-        "shape": user_shape[uid],
-        "upvotes": int(p.get("Score", 0)),
-        "accepted": int(p.get("AcceptedAnswerId", 0)) == aid
-    })
-    answer_df.append(feats)
-
-answers = pd.DataFrame(answer_df)
+# Keep answers by classified users and attach their shape
+answers = answers[answers["owner_id"].isin(list(user_shape))].reset_index(drop=True)
+answers["shape"] = pd.Categorical(answers["owner_id"].map(user_shape))
 print(f"   → {len(answers):,} answers linked to a classified user")
 
-# ------------------------------------------------------------------
-# 5. Prepare data for logistic regression
-# ------------------------------------------------------------------
 # Preference = up-vote OR accepted
 answers["preferred"] = (answers["upvotes"] > 0) | answers["accepted"]
 
-# One-hot features
-feat_cols = ["length", "has_code", "has_image", "has_ref"]
-X = pd.get_dummies(answers[feat_cols], drop_first=True)
-X = X.astype(int)
-y = answers["preferred"].astype(int)
+# 0/1 features, already encoded by answer_features()
+feat_cols = ["is_long", "is_summ", "has_code", "has_image", "has_ref"]
+feat_labels = [
+    "Answer Length (Long)", "Answer Length (Summ.)",
+    "Includes Code", "Includes Image", "Includes Reference"
+]
+X_sp = csr_matrix(answers[feat_cols].to_numpy(dtype=np.float32))   # 0/1 dummies are mostly zero
+y_np = answers["preferred"].to_numpy(dtype=np.float32)
 
-# Add a column for shape
-answers["shape"] = answers["shape"].astype("category")
-shapes = answers["shape"].cat.categories
+# Row indices per shape, computed in one pass
+groups = answers.groupby("shape", observed=True).indices
 
 # ------------------------------------------------------------------
-# 6. Run one logistic regression PER shape
+# 7. Run one logistic regression PER shape
 # ------------------------------------------------------------------
-results = {}
-for shape in shapes:
-    mask = answers["shape"] == shape
-    if mask.sum() < 100:
-        continue
-    X_s = X[mask]
-    y_s = y[mask]
-
-    clf = LogisticRegression(penalty=None, max_iter=1000)
+def _fit_one(shape, X_s, y_s):
+    # joblib workers do not inherit the filter set at the top of the script
+    warnings.filterwarnings('ignore')
+
+    # five features converge well within the default max_iter
+    clf = LogisticRegression(penalty=None, solver="lbfgs")
     clf.fit(X_s, y_s)
 
     coef = clf.coef_[0]
-    intercept = clf.intercept_[0]
-    cols = X_s.columns
-
-    # Build nice table rows
-    row = {}
-    for c, v in zip(cols, coef):
-        if "length" in c:
-            if "_Long" in c:
-                row["Answer Length (Long)"] = round(v, 3)
-            elif "_Summarized" in c:
-                row["Answer Length (Summ.)"] = round(v, 3)
-        elif "has_code" in c:
-            row["Includes Code"] = round(v, 3)
-        elif "has_image" in c:
-            row["Includes Image"] = round(v, 3)
-        elif "has_ref" in c:
-            row["Includes Reference"] = round(v, 3)
-    results[shape] = row
+
+    # Build nice table rows (coef is in feat_cols order)
+    row = {label: round(v, 3) for label, v in zip(feat_labels, coef)}
+    return shape, row
+
+# the shapes are disjoint slices → fit them concurrently
+fits = Parallel(n_jobs=-1)(
+    delayed(_fit_one)(shape, X_sp[idx], y_np[idx])
+    for shape, idx in groups.items() if idx.size >= 100
+)
+results = dict(fits)
 
 # ------------------------------------------------------------------
-# 7. Print Table 1 exactly like the paper
+# 8. Print Table 1 exactly like the paper
 # ------------------------------------------------------------------
 table = pd.DataFrame(results).T
-table = table.reindex(columns=[
-    "Answer Length (Long)", "Answer Length (Summ.)",
-    "Includes Code", "Includes Image", "Includes Reference"
-])
+table = table.reindex(columns=feat_labels)
 print("\n=== Table 1: Logistic Regression Coefficients ===")
 print(table.round(3).to_string())
 